@@ -0,0 +1,174 @@
+"""
+Micro-benchmarks for the cache and JSON hot paths, run against synthetic SearXNG payloads
+
+    python api/bench.py
+"""
+import random
+import time
+import tracemalloc
+
+from fastapi.encoders import jsonable_encoder
+
+from main import (CACHE_CODEC, SearchResponse, available_codecs, compress, decompress,
+                  dumps, encode_body, json, limit_results, loads, orjson)
+
+WORDS = ("python tutorial guide learn code example search engine privacy open source "
+         "image photo wallpaper video news world science data web fast free best").split()
+
+def sentence(rng: random.Random, n: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+def make_result(rng: random.Random, category: str, i: int) -> dict:
+    host = f"www.{rng.choice(WORDS)}{rng.randint(1, 999)}.com"
+    url = f"https://{host}/{rng.choice(WORDS)}/{rng.randint(1000, 99999)}"
+    result = {
+        "url": url,
+        "title": sentence(rng, 8).title(),
+        "content": sentence(rng, 40),
+        "engine": rng.choice(["google", "bing", "duckduckgo", "brave"]),
+        "parsed_url": ["https", host, "/" + rng.choice(WORDS), "", "", ""],
+        "template": "default.html",
+        "engines": ["google", "bing"],
+        "positions": [i + 1, rng.randint(1, 30)],
+        "score": rng.random() * 10,
+        "category": category,
+    }
+    if category == "images":
+        result.update(
+            template="images.html",
+            img_src=f"https://{host}/images/{rng.randint(10**6, 10**7)}.jpg",
+            thumbnail_src=f"https://tse{rng.randint(1, 4)}.mm.bing.net/th?id=OIP.{rng.getrandbits(96):x}",
+            resolution=f"{rng.choice([640, 1280, 1920])} x {rng.choice([480, 720, 1080])}",
+            img_format="jpeg",
+            source=host,
+        )
+    elif category == "videos":
+        result.update(
+            template="videos.html",
+            thumbnail=f"https://i.ytimg.com/vi/{rng.getrandbits(48):x}/hqdefault.jpg",
+            iframe_src=f"https://www.youtube-nocookie.com/embed/{rng.getrandbits(48):x}",
+            length=f"{rng.randint(1, 59)}:{rng.randint(0, 59):02d}",
+            author=sentence(rng, 2).title(),
+            publishedDate="2024-05-01T12:00:00",
+        )
+    elif category == "news":
+        result["publishedDate"] = "2024-05-01T12:00:00"
+    return result
+
+def make_payload(category: str = "general", n: int = 30, seed: int = 0) -> dict:
+    """A SearXNG JSON response shaped like the real thing"""
+    rng = random.Random(seed)
+    return {
+        "query": sentence(rng, 2),
+        "number_of_results": rng.randint(10**4, 10**7),
+        "results": [make_result(rng, category, i) for i in range(n)],
+        "answers": [],
+        "corrections": [],
+        "infoboxes": [],
+        "suggestions": [sentence(rng, 3) for _ in range(5)],
+        "unresponsive_engines": [["qwant", "timeout"]],
+    }
+
+PAYLOADS = {
+    "web x30": make_payload("general", 30),
+    "news x30": make_payload("news", 30),
+    "images x100": make_payload("images", 100),
+    "videos x30": make_payload("videos", 30),
+}
+
+def timed(fn, repeat: int = 200) -> float:
+    """Mean microseconds per call"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1e6
+
+def bench_codecs():
+    """Bytes saved versus CPU cost for each cache codec and level"""
+    print(f"{'payload':<13}{'codec':<10}{'bytes':>9}{'ratio':>7}{'compress us':>13}{'hit us':>9}")
+    for name, payload in PAYLOADS.items():
+        raw = dumps(payload)
+        for codec in available_codecs():
+            levels = {"gzip": (1, 6, 9), "br": (1, 5, 9), "zstd": (1, 3, 9)}.get(codec, (0,))
+            for level in levels:
+                body = compress(raw, codec, level)
+                compress_us = timed(lambda: compress(raw, codec, level))
+                # A cache hit pays decompression plus parsing
+                hit_us = timed(lambda: loads(decompress(body, codec)))
+                label = codec if codec == "identity" else f"{codec}:{level}"
+                print(f"{name:<13}{label:<10}{len(body):>9}{len(raw) / len(body):>7.1f}"
+                      f"{compress_us:>13.0f}{hit_us:>9.0f}")
+
+def stdlib_encode(value: dict) -> bytes:
+    """What FastAPI's JSONResponse does with a returned dict"""
+    return json.dumps(jsonable_encoder(value), ensure_ascii=False, allow_nan=False,
+                      indent=None, separators=(",", ":")).encode()
+
+def bench_json():
+    """Upstream decode and response encode: stdlib/jsonable_encoder vs the fast path"""
+    if orjson is None:
+        print("orjson is not installed; the fast path is the stdlib")
+    print(f"{'payload':<13}{'bytes':>9}{'old decode':>12}{'new decode':>12}"
+          f"{'old encode':>12}{'new encode':>12}{'speedup':>9}")
+    for name, payload in PAYLOADS.items():
+        raw = dumps(payload)
+        old_decode = timed(lambda: json.loads(raw.decode()))
+        new_decode = timed(lambda: loads(raw))
+        old_encode = timed(lambda: stdlib_encode(payload))
+        new_encode = timed(lambda: dumps(payload))
+        speedup = (old_decode + old_encode) / (new_decode + new_encode)
+        print(f"{name:<13}{len(raw):>9}{old_decode:>12.0f}{new_decode:>12.0f}"
+              f"{old_encode:>12.0f}{new_encode:>12.0f}{speedup:>8.1f}x")
+
+def peak(fn) -> int:
+    """Peak bytes allocated while `fn` runs"""
+    tracemalloc.start()
+    fn()
+    size = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return size
+
+def bench_model():
+    """Cache-miss path with and without the result model: peak allocation and output size"""
+    print(f"{'payload':<13}{'dict peak KB':>13}{'model peak KB':>14}{'dict out':>10}{'model out':>11}")
+    for name, payload in PAYLOADS.items():
+        raw = dumps(payload)
+        dict_kb = peak(lambda: dumps(loads(raw))) / 1024
+        model_kb = peak(lambda: dumps(SearchResponse.from_dict(loads(raw)).to_dict())) / 1024
+        model_out = len(dumps(SearchResponse.from_dict(loads(raw)).to_dict()))
+        print(f"{name:<13}{dict_kb:>13.0f}{model_kb:>14.0f}{len(raw):>10}{model_out:>11}")
+
+def bench_miss(limit: int = 5):
+    """Cache-miss cost of answering `limit` results: re-reading the stored page vs the decoded one"""
+    print(f"{'payload':<13}{'cached old us':>14}{'cached new us':>14}{'uncached old us':>16}{'uncached new us':>16}")
+    for name, payload in PAYLOADS.items():
+        raw = dumps(payload)
+
+        def cached_old():
+            page = SearchResponse.from_dict(loads(raw))
+            body = encode_body(page.to_dict(), CACHE_CODEC)
+            encode_body(limit_results(loads(decompress(body, CACHE_CODEC)), limit), CACHE_CODEC)
+
+        def cached_new():
+            page = SearchResponse.from_dict(loads(raw))
+            encode_body(page.to_dict(), CACHE_CODEC)
+            encode_body(page.to_dict(limit), CACHE_CODEC)
+
+        def uncached_old():
+            body = dumps(SearchResponse.from_dict(loads(raw)).to_dict())
+            dumps(limit_results(loads(body), limit))
+
+        def uncached_new():
+            dumps(SearchResponse.from_dict(loads(raw)).to_dict(limit))
+
+        print(f"{name:<13}{timed(cached_old):>14.0f}{timed(cached_new):>14.0f}"
+              f"{timed(uncached_old):>16.0f}{timed(uncached_new):>16.0f}")
+
+if __name__ == "__main__":
+    bench_codecs()
+    print()
+    bench_json()
+    print()
+    bench_model()
+    print()
+    bench_miss()
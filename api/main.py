@@ -2,16 +2,169 @@
 SearXNG Search API - Uses public instances
 Lightweight wrapper around public SearXNG instances
 """
-from fastapi import FastAPI, HTTPException, Query
+import argparse
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse
+import asyncio
+import gzip
+import heapq
+import hmac
 import httpx
+import importlib.util
+import itertools
+import json
+import math
+import mmap
+import os
 import random
-from typing import List, Optional
+import re
+import sqlite3
+import struct
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict, deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+# JSON: orjson when installed (several times faster on large result pages),
+# otherwise the stdlib
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def loads(data: bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def dumps(value: dict) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(value)
+        except TypeError:
+            pass  # e.g. integers beyond 64 bits; the stdlib handles them
+    return json.dumps(value, separators=(",", ":")).encode()
+
+# Upstream connection pool (one long-lived client per instance, per worker)
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+
+# HTTP/2 multiplexes concurrent queries over a few connections per instance.
+# Needs the optional `h2` package (httpx[http2]); falls back to HTTP/1.1.
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+HTTP2_ENABLED = os.getenv("HTTP2", "1") == "1" and HTTP2_AVAILABLE
+
+# Default per-instance budget; override per instance with INSTANCE_BUDGETS, e.g.
+# '{"https://searx.ox2.fr": {"max_connections": 2, "max_streams": 50}}'
+INSTANCE_MAX_CONNECTIONS = int(os.getenv("INSTANCE_MAX_CONNECTIONS", "4"))
+INSTANCE_MAX_STREAMS = int(os.getenv("INSTANCE_MAX_STREAMS", "100"))
+INSTANCE_BUDGETS = json.loads(os.getenv("INSTANCE_BUDGETS", "{}"))
+
+http_clients: Dict[str, httpx.AsyncClient] = {}
+stream_slots: Dict[str, asyncio.Semaphore] = {}
+
+def instance_budget(instance: str) -> Dict[str, int]:
+    """Connection and stream budget for one instance"""
+    budget = {
+        "max_connections": INSTANCE_MAX_CONNECTIONS if HTTP2_ENABLED else HTTP_MAX_CONNECTIONS,
+        "max_streams": INSTANCE_MAX_STREAMS,
+    }
+    budget.update(INSTANCE_BUDGETS.get(instance, {}))
+    return budget
+
+def create_client(instance: str) -> httpx.AsyncClient:
+    """Build the upstream client for one instance with pooled keep-alive connections"""
+    budget = instance_budget(instance)
+    return httpx.AsyncClient(
+        base_url=instance,
+        http2=HTTP2_ENABLED,
+        timeout=HTTP_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=budget["max_connections"],
+            max_keepalive_connections=min(HTTP_MAX_KEEPALIVE, budget["max_connections"]),
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+def get_client(instance: str) -> httpx.AsyncClient:
+    """Return the instance's client, creating it lazily outside the lifespan"""
+    client = http_clients.get(instance)
+    if client is None or client.is_closed:
+        client = http_clients[instance] = create_client(instance)
+    return client
+
+def get_stream_slots(instance: str) -> asyncio.Semaphore:
+    """Caps concurrent requests to max_connections * max_streams per instance"""
+    slots = stream_slots.get(instance)
+    if slots is None:
+        budget = instance_budget(instance)
+        if HTTP2_ENABLED:
+            capacity = budget["max_connections"] * budget["max_streams"]
+        else:
+            capacity = budget["max_connections"]
+        slots = stream_slots[instance] = asyncio.Semaphore(capacity)
+    return slots
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open upstream pools, caches and background tasks; close them at shutdown"""
+    global disk_cache, query_log
+    for instance in SEARXNG_INSTANCES:
+        get_client(instance)
+    if CACHE_SNAPSHOT_PATH and CACHE_ENABLED:
+        try:
+            load_snapshot_file(CACHE_SNAPSHOT_PATH)
+        except (OSError, ValueError):
+            pass  # Missing or corrupt snapshot: start cold
+    background = [asyncio.create_task(health_prober())]
+    if DISK_CACHE_PATH:
+        disk_cache = DiskCache(DISK_CACHE_PATH)
+        background.append(asyncio.create_task(disk_compactor()))
+    if CACHE_ENABLED and HEAVY_HITTERS_K > 0:
+        background.append(asyncio.create_task(hot_key_refresher()))
+    if QUERY_LOG_PATH:
+        query_log = QueryLog(QUERY_LOG_PATH)
+        background.append(asyncio.create_task(query_log_flusher()))
+        if CACHE_ENABLED and WARMUP_TOP_N > 0:
+            background.append(asyncio.create_task(warm_up()))
+    try:
+        yield
+    finally:
+        for task in background:
+            task.cancel()
+        if CACHE_SNAPSHOT_PATH and CACHE_ENABLED:
+            try:
+                save_snapshot_file(CACHE_SNAPSHOT_PATH)
+            except OSError:
+                pass
+        if query_log is not None:
+            try:
+                query_log.flush()
+            except OSError:
+                pass
+            query_log = None
+        if disk_cache is not None:
+            if demotions:
+                await asyncio.wait(demotions)
+            demote_all()
+            disk_cache.close()
+            disk_cache = None
+        for client in http_clients.values():
+            await client.aclose()
+        http_clients.clear()
+        stream_slots.clear()
 
 app = FastAPI(
     title="SearXNG Search API",
     description="Web search using public SearXNG instances",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse if orjson is not None else JSONResponse,
 )
 
 # CORS
@@ -27,137 +180,1546 @@ SEARXNG_INSTANCES = [
     "https://searx.ox2.fr",           # 0.195s, 99% uptime, A+ grade
 ]
 
+# Hedging: if an instance is slow to answer, race the next one against it
+HEDGING = os.getenv("HEDGING", "1") == "1"
+HEDGE_DELAY = float(os.getenv("HEDGE_DELAY", "1.0"))             # used until enough samples
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.05"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+LATENCY_WINDOW = int(os.getenv("LATENCY_WINDOW", "200"))
+
+# Instance selection: "p2c" (power of two choices), "ewma" or "random"
+LOAD_BALANCER = os.getenv("LOAD_BALANCER", "p2c")
+EWMA_ALPHA = float(os.getenv("EWMA_ALPHA", "0.3"))
+FAILURE_PENALTY = float(os.getenv("FAILURE_PENALTY", str(HTTP_TIMEOUT)))
+
+class InstanceStats:
+    """Rolling latency observations for one upstream instance"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.samples: Deque[float] = deque(maxlen=window)
+        self.ewma: Optional[float] = None
+        self.in_flight = 0
+
+    def observe(self, latency: float):
+        self.samples.append(latency)
+        self.observe_ewma(latency)
+
+    def observe_ewma(self, latency: float):
+        if self.ewma is None:
+            self.ewma = latency
+        else:
+            self.ewma += EWMA_ALPHA * (latency - self.ewma)
+
+    def score(self) -> float:
+        """Expected cost of sending one more request here (lower is better)"""
+        # Unmeasured instances score 0 so they get explored first
+        return (self.ewma or 0.0) * (self.in_flight + 1)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(len(ordered) * p / 100))
+        return ordered[index]
+
+instance_stats: Dict[str, InstanceStats] = {}
+
+def get_stats(instance: str) -> InstanceStats:
+    stats = instance_stats.get(instance)
+    if stats is None:
+        stats = instance_stats[instance] = InstanceStats()
+    return stats
+
+def hedge_delay(instance: str) -> float:
+    """How long to wait on an instance before hedging, from its observed tail latency"""
+    stats = get_stats(instance)
+    if len(stats.samples) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DELAY
+    return max(HEDGE_MIN_DELAY, stats.percentile(HEDGE_PERCENTILE))
+
+def balance_random(instances: List[str]) -> List[str]:
+    ordered = instances.copy()
+    random.shuffle(ordered)
+    return ordered
+
+def balance_ewma(instances: List[str]) -> List[str]:
+    """Fastest (by load-weighted EWMA latency) first"""
+    ordered = balance_random(instances)  # Random tie-break
+    ordered.sort(key=lambda instance: get_stats(instance).score())
+    return ordered
+
+def balance_p2c(instances: List[str]) -> List[str]:
+    """Power of two choices: repeatedly keep the better of two random picks"""
+    remaining = instances.copy()
+    ordered = []
+    while len(remaining) > 1:
+        a, b = random.sample(remaining, 2)
+        best = a if get_stats(a).score() <= get_stats(b).score() else b
+        remaining.remove(best)
+        ordered.append(best)
+    return ordered + remaining
+
+BALANCERS: Dict[str, Callable[[List[str]], List[str]]] = {
+    "random": balance_random,
+    "ewma": balance_ewma,
+    "p2c": balance_p2c,
+}
+
+def order_instances(instances: List[str]) -> List[str]:
+    """Order instances by preference using the configured balancer"""
+    ordered = BALANCERS.get(LOAD_BALANCER, balance_p2c)(instances)
+    # Instances the health prober saw down are kept only as a last resort
+    return sorted(ordered, key=lambda instance: is_down(instance))
+
+# Circuit breaker: skip instances that keep failing, probe them for recovery
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+BREAKER_HALF_OPEN_PROBES = int(os.getenv("BREAKER_HALF_OPEN_PROBES", "1"))
+
+class CircuitBreaker:
+    """Closed -> open after repeated failures -> half-open probes -> closed"""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+
+    def allow_request(self) -> bool:
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < BREAKER_RESET_TIMEOUT:
+                return False
+            self.state = self.HALF_OPEN
+            self.probes = 0
+        if self.state == self.HALF_OPEN:
+            if self.probes >= BREAKER_HALF_OPEN_PROBES:
+                return False
+            self.probes += 1
+        return True
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.probes = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= BREAKER_FAILURE_THRESHOLD:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self.probes = 0
+
+    def record_cancel(self):
+        """A probe was abandoned without a verdict; free its slot"""
+        if self.state == self.HALF_OPEN and self.probes:
+            self.probes -= 1
+
+breakers: Dict[str, CircuitBreaker] = {}
+
+def get_breaker(instance: str) -> CircuitBreaker:
+    breaker = breakers.get(instance)
+    if breaker is None:
+        breaker = breakers[instance] = CircuitBreaker()
+    return breaker
+
+# Compact result model: only these fields survive encoding; the rest of each
+# upstream result (parsed_url, positions, template, ...) is dropped
+class SearchResult:
+    """One SearXNG result"""
+
+    __slots__ = ("url", "title", "content", "engine", "engines", "category", "score",
+                 "publishedDate", "author", "img_src", "thumbnail_src", "thumbnail",
+                 "resolution", "img_format", "source", "iframe_src", "length")
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SearchResult":
+        result = cls()
+        for field in cls.__slots__:
+            if field in data:
+                setattr(result, field, data[field])
+        return result
+
+    def to_dict(self) -> dict:
+        # Unset slots are skipped, so absent fields stay absent in the output
+        return {field: getattr(self, field) for field in self.__slots__ if hasattr(self, field)}
+
+class SearchResponse:
+    """A SearXNG response: its results plus the small top-level fields
+
+    Results stay as decoded upstream dicts until encoded, and to_dict(limit) only
+    turns the first `limit` of them into SearchResults.
+    """
+
+    __slots__ = ("query", "number_of_results", "results", "answers", "corrections",
+                 "infoboxes", "suggestions", "unresponsive_engines", "instance_used")
+
+    def __init__(self):
+        self.query = None
+        self.number_of_results = 0
+        self.results: List[dict] = []
+        self.answers: list = []
+        self.corrections: list = []
+        self.infoboxes: list = []
+        self.suggestions: list = []
+        self.unresponsive_engines: list = []
+        self.instance_used: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SearchResponse":
+        response = cls()
+        for field in cls.__slots__[:-1]:
+            if field in data:
+                setattr(response, field, data[field])
+        return response
+
+    def to_dict(self, limit: Optional[int] = None) -> dict:
+        data = {field: getattr(self, field) for field in self.__slots__[:-1]}
+        data["results"] = [SearchResult.from_dict(result).to_dict() for result in self.results[:limit]]
+        data["_instance_used"] = self.instance_used
+        return data
+
 async def search_instance(instance: str, query: str, category: str = "general", 
                           language: str = "en", safesearch: int = 1):
     """Search a single SearXNG instance"""
+    breaker = get_breaker(instance)
+    stats = get_stats(instance)
+    stats.in_flight += 1
+    started = time.perf_counter()
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            params = {
-                "q": query,
-                "format": "json",
-                "language": language,
-                "safesearch": safesearch,
-            }
-            if category != "general":
-                params["category"] = category
-                
-            response = await client.get(f"{instance}/search", params=params)
+        params = {
+            "q": query,
+            "format": "json",
+            "language": language,
+            "safesearch": safesearch,
+        }
+        if category != "general":
+            params["category"] = category
             
-            if response.status_code == 200:
-                return response.json()
-            return None
+        async with get_stream_slots(instance):
+            response = await get_client(instance).get("/search", params=params)
+        
+        if response.status_code == 200:
+            result = SearchResponse.from_dict(loads(response.content))
+            stats.observe(time.perf_counter() - started)
+            breaker.record_success()
+            return result
+    except asyncio.CancelledError:
+        # Lost a hedge race: it took at least this long
+        stats.observe_ewma(time.perf_counter() - started)
+        breaker.record_cancel()
+        raise
     except Exception:
-        return None
+        pass
+    finally:
+        stats.in_flight -= 1
+    # Failures count as slow answers so the balancer routes around them
+    stats.observe_ewma(max(FAILURE_PENALTY, time.perf_counter() - started))
+    breaker.record_failure()
+    return None
 
 async def search_with_fallback(query: str, category: str = "general",
                                   language: str = "en", safesearch: int = 1):
-    """Try multiple instances until one works"""
-    # Shuffle instances for load balancing
-    instances = SEARXNG_INSTANCES.copy()
-    random.shuffle(instances)
+    """Try multiple instances until one works, hedging slow ones when enabled"""
+    queue = order_instances(SEARXNG_INSTANCES)
+    attempts = 5  # Try first 5 instances whose circuit allows it
     
     errors = []
-    for instance in instances[:5]:  # Try first 5
-        result = await search_instance(instance, query, category, language, safesearch)
-        if result:
-            # Add metadata
-            result["_instance_used"] = instance
-            return result
-        errors.append(f"{instance}: failed")
+    pending: Dict[asyncio.Task, str] = {}
+
+    def launch() -> Optional[str]:
+        nonlocal attempts
+        while queue and attempts:
+            instance = queue.pop(0)
+            if not get_breaker(instance).allow_request():
+                errors.append(f"{instance}: circuit open")
+                continue
+            attempts -= 1
+            task = asyncio.create_task(
+                search_instance(instance, query, category, language, safesearch))
+            pending[task] = instance
+            return instance
+        return None
+
+    latest = launch()
+    try:
+        while pending:
+            # Hedge only while there is another instance left to race against
+            can_hedge = HEDGING and queue and attempts
+            timeout = hedge_delay(latest) if can_hedge else None
+            done, _ = await asyncio.wait(pending, timeout=timeout,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                latest = launch() or latest
+                continue
+            for task in done:
+                instance = pending.pop(task)
+                result = task.result()
+                if result:
+                    # Add metadata
+                    result.instance_used = instance
+                    return result
+                errors.append(f"{instance}: failed")
+            if not pending:
+                latest = launch()
+    finally:
+        # Cancel the losers of the race
+        for task in pending:
+            task.cancel()
     
     raise HTTPException(status_code=503, detail=f"All instances failed. Errors: {errors}")
 
+# In-process response cache: TTL + LRU, bounded by entry count and bytes
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "1") == "1"
+CACHE_TTL = float(os.getenv("CACHE_TTL", "3600"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1000"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Eviction looks at this many least recently used entries and drops the largest,
+# so one big image page goes before several small web pages
+CACHE_EVICTION_SAMPLE = int(os.getenv("CACHE_EVICTION_SAMPLE", "8"))
+
+# Freshness policy per category; anything unlisted uses CACHE_TTL
+CACHE_TTLS = {
+    "general": float(os.getenv("CACHE_TTL_GENERAL", str(CACHE_TTL))),
+    "news": float(os.getenv("CACHE_TTL_NEWS", "300")),
+    "images": float(os.getenv("CACHE_TTL_IMAGES", "86400")),
+    "videos": float(os.getenv("CACHE_TTL_VIDEOS", "21600")),
+}
+
+# Negative caching: failures and empty result pages are remembered briefly so
+# repeats fail fast instead of re-running the slow failure path
+NEGATIVE_CACHE_TTL = float(os.getenv("NEGATIVE_CACHE_TTL", "15"))
+EMPTY_RESULT_TTL = float(os.getenv("EMPTY_RESULT_TTL", "60"))
+
+# Probabilistic early expiration (XFetch): hot entries are refreshed in the
+# background shortly before they expire, so they never all miss at once
+XFETCH_BETA = float(os.getenv("XFETCH_BETA", "1.0"))
+
+def cache_ttl(category: str) -> float:
+    return CACHE_TTLS.get(category, CACHE_TTL)
+
+# Past expiry, entries are served stale while a background refresh runs, and
+# as a fallback when every instance fails
+CACHE_STALE_WHILE_REVALIDATE = float(os.getenv("CACHE_STALE_WHILE_REVALIDATE", "600"))
+CACHE_STALE_IF_ERROR = float(os.getenv("CACHE_STALE_IF_ERROR", "86400"))
+
+# Cached bodies are stored compressed; codec names are HTTP Content-Encoding tokens
+CACHE_CODEC = os.getenv("CACHE_CODEC", "gzip")
+CACHE_COMPRESSION_LEVEL = os.getenv("CACHE_COMPRESSION_LEVEL", "")
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DEFAULT_LEVELS = {"gzip": 6, "br": 5, "zstd": 3}
+
+def available_codecs() -> List[str]:
+    codecs = ["identity", "gzip"]
+    if brotli is not None:
+        codecs.append("br")
+    if zstandard is not None:
+        codecs.append("zstd")
+    return codecs
+
+def compress(data: bytes, codec: str, level: Optional[int] = None) -> bytes:
+    if level is None:
+        level = DEFAULT_LEVELS.get(codec, 0)
+    if codec == "gzip":
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    if codec == "br":
+        return brotli.compress(data, quality=level)
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return data
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "gzip":
+        return gzip.decompress(data)
+    if codec == "br":
+        return brotli.decompress(data)
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+if CACHE_CODEC not in available_codecs():
+    CACHE_CODEC = "gzip"
+CACHE_LEVEL = int(CACHE_COMPRESSION_LEVEL) if CACHE_COMPRESSION_LEVEL else DEFAULT_LEVELS.get(CACHE_CODEC)
+
+def encode_body(value: dict, codec: str = CACHE_CODEC) -> bytes:
+    """Serialize and compress a result for caching"""
+    return compress(dumps(value), codec, CACHE_LEVEL if codec == CACHE_CODEC else None)
+
+# Response compression for everything not already sent as stored compressed bytes:
+# small endpoints, cache hits whose stored codec the client doesn't accept, and
+# uncached responses. Negotiated per request in RESPONSE_CODECS preference order.
+RESPONSE_COMPRESSION = os.getenv("RESPONSE_COMPRESSION", "1") == "1"
+RESPONSE_COMPRESSION_MIN_SIZE = int(os.getenv("RESPONSE_COMPRESSION_MIN_SIZE", "1024"))
+RESPONSE_CODECS = [codec for codec in os.getenv("RESPONSE_CODECS", "zstd,br,gzip").split(",")
+                   if codec in available_codecs() and codec != "identity"]
+# Per-response compression sits on the request path, so brotli runs cheaper than for the cache
+RESPONSE_COMPRESSION_LEVELS = dict(DEFAULT_LEVELS, br=4)
+RESPONSE_COMPRESSION_LEVELS.update(
+    (codec.strip(), int(level)) for codec, _, level in
+    (item.partition(":") for item in os.getenv("RESPONSE_COMPRESSION_LEVELS", "").split(",") if item))
+COMPRESSIBLE_TYPES = ("application/json", "application/javascript", "application/xml")
+
+def negotiate_encoding(accept_encoding: str, codecs: List[str]) -> Optional[str]:
+    """Codec from `codecs` the client ranks highest (ties go to the earlier one)"""
+    ranks = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                continue
+        ranks[name.strip().lower()] = quality
+    best, best_quality = None, 0.0
+    for codec in codecs:
+        quality = ranks.get(codec, ranks.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = codec, quality
+    return best
+
+class CompressionStats:
+    """Counters for CompressionMiddleware"""
+
+    def __init__(self):
+        self.compressed = Counter()
+        self.bytes_in = Counter()
+        self.bytes_out = Counter()
+        self.cpu_seconds = Counter()
+        self.skipped = Counter()  # reason -> responses sent as-is
+
+    def record(self, codec: str, size: int, compressed: int, cpu: float):
+        self.compressed[codec] += 1
+        self.bytes_in[codec] += size
+        self.bytes_out[codec] += compressed
+        self.cpu_seconds[codec] += cpu
+
+    def stats(self) -> dict:
+        return {
+            "enabled": RESPONSE_COMPRESSION,
+            "codecs": {
+                codec: {
+                    "responses": self.compressed[codec],
+                    "bytes_in": self.bytes_in[codec],
+                    "bytes_out": self.bytes_out[codec],
+                    "ratio": self.bytes_in[codec] / self.bytes_out[codec] if self.bytes_out[codec] else 0.0,
+                    "cpu_ms": self.cpu_seconds[codec] * 1000,
+                    "cpu_us_per_kb": (self.cpu_seconds[codec] * 1e6 / (self.bytes_in[codec] / 1024)
+                                      if self.bytes_in[codec] else 0.0),
+                }
+                for codec in self.compressed
+            },
+            "skipped": dict(self.skipped),
+        }
+
+compression_stats = CompressionStats()
+
+class CompressionMiddleware:
+    """ASGI middleware compressing whole JSON/text bodies of at least `minimum_size` bytes"""
+
+    def __init__(self, app, minimum_size: int = RESPONSE_COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        accept_encoding = ""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+        codec = negotiate_encoding(accept_encoding, RESPONSE_CODECS)
+        if codec is None:
+            compression_stats.skipped["not_accepted"] += 1
+            return await self.app(scope, receive, send)
+        start = None
+
+        async def send_compressed(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if start is None:
+                return await send(message)  # Already passed through
+            response_start, start = start, None
+            reason = self.skip_reason(response_start, message)
+            if reason is not None:
+                compression_stats.skipped[reason] += 1
+                await send(response_start)
+                return await send(message)
+            body = message["body"]
+            started = time.thread_time()
+            compressed = compress(body, codec, RESPONSE_COMPRESSION_LEVELS.get(codec))
+            compression_stats.record(codec, len(body), len(compressed), time.thread_time() - started)
+            headers = [(name, value) for name, value in response_start["headers"]
+                       if name not in (b"content-length", b"vary")]
+            vary = [value.decode("latin-1") for name, value in response_start["headers"] if name == b"vary"]
+            if not any("accept-encoding" in value.lower() for value in vary):
+                vary.append("Accept-Encoding")
+            headers += [(b"content-encoding", codec.encode()),
+                        (b"content-length", str(len(compressed)).encode()),
+                        (b"vary", ", ".join(vary).encode("latin-1"))]
+            await send(dict(response_start, headers=headers))
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_compressed)
+
+    def skip_reason(self, start: dict, message: dict) -> Optional[str]:
+        """Why a response goes out as-is, or None to compress it"""
+        if message.get("more_body"):
+            return "streaming"  # Only whole bodies are compressed; streams pass through
+        content_type = b""
+        for name, value in start["headers"]:
+            if name == b"content-encoding":
+                return "precompressed"  # Cache hits already carry their stored codec
+            if name == b"content-type":
+                content_type = value
+        media_type = content_type.decode("latin-1").partition(";")[0].strip().lower()
+        if not (media_type.startswith("text/") or media_type in COMPRESSIBLE_TYPES
+                or media_type.endswith("+json")):
+            return "content_type"
+        if len(message.get("body", b"")) < self.minimum_size:
+            return "too_small"
+        return None
+
+if RESPONSE_COMPRESSION:
+    app.add_middleware(CompressionMiddleware)
+
+# Pre-rendered bodies kept per entry for `limit` values below its result count
+CACHE_MAX_VARIANTS = int(os.getenv("CACHE_MAX_VARIANTS", "4"))
+
+class CacheEntry:
+    """A cached upstream result, held as compressed JSON ready to send"""
+
+    __slots__ = ("body", "codec", "stored_at", "expires_at", "count", "variants", "error",
+                 "delta", "page")
+
+    def __init__(self, body: bytes, codec: str, stored_at: float, expires_at: float,
+                 count: Optional[int] = None, error: Optional[str] = None):
+        self.body = body
+        self.codec = codec
+        self.stored_at = stored_at
+        self.expires_at = expires_at
+        self.count = count  # Number of results; None until known
+        self.variants: Optional[Dict[tuple, bytes]] = None  # (limit, fields) -> body
+        self.error = error  # Set on negative entries: the upstream failure detail
+        self.delta: Optional[float] = None  # Seconds the upstream fetch took
+        self.page: Optional["SearchResponse"] = None  # Only on a fetch's uncached copy
+
+    def refresh_early(self, now: float) -> bool:
+        """XFetch: refresh before expiry with probability rising as expiry nears
+        and with how long the entry takes to recompute"""
+        if self.delta is None or XFETCH_BETA <= 0:
+            return False
+        return now - self.delta * XFETCH_BETA * math.log(1.0 - random.random()) >= self.expires_at
+
+    @property
+    def size(self) -> int:
+        if not self.variants:
+            return len(self.body)
+        return len(self.body) + sum(len(body) for body in self.variants.values())
+
+    @property
+    def value(self) -> dict:
+        return loads(decompress(self.body, self.codec))
+
+    def is_fresh(self, now: float, max_age: Optional[float] = None) -> bool:
+        if max_age is not None and now - self.stored_at > max_age:
+            return False
+        return now < self.expires_at
+
+class ResponseCache:
+    """LRU cache of upstream results with per-entry TTL and a memory budget"""
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES,
+                 grace: float = max(CACHE_STALE_WHILE_REVALIDATE, CACHE_STALE_IF_ERROR)):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.grace = grace  # How long expired entries are retained for stale serving
+        self.entries: "OrderedDict[tuple, CacheEntry]" = OrderedDict()
+        self.on_evict: Optional[Callable[[tuple, CacheEntry], None]] = None
+        self.pinned: set = set()  # Hot keys eviction skips
+        self.bytes = 0
+        self.memory_hits = 0
+        self.memory_misses = 0
+        self.hits = 0
+        self.early_refreshes = 0
+        self.negative_hits = 0
+        self.stale_hits = 0
+        self.stale_if_error = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, key: tuple) -> Optional[CacheEntry]:
+        """Entry within its TTL or stale grace window, marked recently used"""
+        entry = self.entries.get(key)
+        if entry is not None and entry.expires_at + self.grace <= time.monotonic():
+            self._remove(key)
+            entry = None
+        if entry is None:
+            self.memory_misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.memory_hits += 1
+        return entry
+
+    def insert(self, key: tuple, entry: CacheEntry):
+        if entry.size > self.max_bytes:
+            return
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = entry
+        self.bytes += entry.size
+        self._shrink(keep=key)
+
+    def add_variant(self, key: tuple, entry: CacheEntry, variant: tuple, body: bytes):
+        """Remember a pre-rendered body of `entry` for a (limit, fields) pair"""
+        if entry.variants is None:
+            entry.variants = {}
+        if len(entry.variants) >= CACHE_MAX_VARIANTS:
+            return
+        entry.variants[variant] = body
+        if self.entries.get(key) is entry:
+            self.bytes += len(body)
+            self._shrink(keep=key)
+
+    def _shrink(self, keep: Optional[tuple] = None):
+        while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+            victim = self._victim(keep)
+            if victim is None:
+                break
+            evicted = self._remove(victim)
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(victim, evicted)
+
+    def _victim(self, keep: Optional[tuple] = None) -> Optional[tuple]:
+        """Largest of the least recently used unpinned entries, never `keep` (the one just added)"""
+        unpinned = ((key, entry) for key, entry in self.entries.items()
+                    if key != keep and key not in self.pinned)
+        candidates = list(itertools.islice(unpinned, max(1, CACHE_EVICTION_SAMPLE)))
+        if not candidates:  # Everything else is pinned: fall back to plain LRU
+            return next((key for key in self.entries if key != keep), None)
+        return max(candidates, key=lambda item: item[1].size)[0]
+
+    def _remove(self, key: tuple) -> CacheEntry:
+        entry = self.entries.pop(key)
+        self.bytes -= entry.size
+        return entry
+
+    def stats(self) -> dict:
+        served = self.hits + self.negative_hits + self.stale_hits
+        lookups = served + self.misses
+        memory_lookups = self.memory_hits + self.memory_misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "codec": CACHE_CODEC,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "early_refreshes": self.early_refreshes,
+            "stale_hits": self.stale_hits,
+            "stale_if_error": self.stale_if_error,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": served / lookups if lookups else 0.0,
+            "memory_hits": self.memory_hits,
+            "memory_misses": self.memory_misses,
+            "memory_hit_ratio": self.memory_hits / memory_lookups if memory_lookups else 0.0,
+        }
+
+response_cache = ResponseCache()
+
+# Optional on-disk cache (SQLite in WAL mode) shared by all workers on the host;
+# it survives restarts, so warm boots don't have to go upstream
+DISK_CACHE_PATH = os.getenv("DISK_CACHE_PATH", "")
+DISK_CACHE_MAX_BYTES = int(os.getenv("DISK_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+DISK_CACHE_COMPACT_INTERVAL = float(os.getenv("DISK_CACHE_COMPACT_INTERVAL", "300"))
+# Write-through shares fresh results with the other workers immediately; with it
+# off the disk is a victim tier fed only by memory evictions (and shutdown)
+DISK_CACHE_WRITE_THROUGH = os.getenv("DISK_CACHE_WRITE_THROUGH", "1") == "1"
+
+class DiskCache:
+    """SQLite result cache; timestamps are wall-clock so they survive restarts"""
+
+    def __init__(self, path: str, max_bytes: int = DISK_CACHE_MAX_BYTES,
+                 grace: float = max(CACHE_STALE_WHILE_REVALIDATE, CACHE_STALE_IF_ERROR)):
+        self.max_bytes = max_bytes
+        self.grace = grace
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL,"
+            " stored_at REAL NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL,"
+            " codec TEXT NOT NULL DEFAULT 'identity')")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed_at)")
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(cache)")]
+        if "codec" not in columns:
+            # Databases written before compression hold plain JSON
+            try:
+                self.conn.execute("ALTER TABLE cache ADD COLUMN codec TEXT NOT NULL DEFAULT 'identity'")
+            except sqlite3.OperationalError as e:
+                if "duplicate column" not in str(e):
+                    raise  # Otherwise another worker migrated it first
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.compacted = 0
+
+    def get(self, key: tuple) -> Optional[Tuple[bytes, str, float, float]]:
+        """(body, codec, stored_at, expires_at) if retained, else None"""
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value, codec, stored_at, expires_at FROM cache WHERE key = ? AND expires_at > ?",
+                (json.dumps(key), now - self.grace)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, json.dumps(key)))
+            self.hits += 1
+        return row
+
+    def set(self, key: tuple, body: bytes, codec: str, stored_at: float, expires_at: float):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO cache"
+                " (key, value, size, stored_at, expires_at, accessed_at, codec)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (json.dumps(key), body, len(body), stored_at, expires_at, time.time(), codec))
+            self.writes += 1
+
+    def compact(self) -> int:
+        """Drop entries past their grace window, then least recently used ones over budget"""
+        with self.lock:
+            removed = self.conn.execute(
+                "DELETE FROM cache WHERE expires_at <= ?", (time.time() - self.grace,)).rowcount
+            total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+            if total > self.max_bytes:
+                cutoff, excess = None, total - self.max_bytes
+                for accessed_at, size in self.conn.execute(
+                        "SELECT accessed_at, size FROM cache ORDER BY accessed_at"):
+                    cutoff = accessed_at
+                    excess -= size
+                    if excess <= 0:
+                        break
+                removed += self.conn.execute(
+                    "DELETE FROM cache WHERE accessed_at <= ?", (cutoff,)).rowcount
+            self.compacted += removed
+        return removed
+
+    def stats(self) -> dict:
+        with self.lock:
+            entries, size = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "path": DISK_CACHE_PATH,
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "compacted": self.compacted,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+disk_cache: Optional[DiskCache] = None
+
+async def load_from_disk(key: tuple) -> Optional[CacheEntry]:
+    """Fetch an entry from the disk cache and promote it into memory"""
+    row = await asyncio.to_thread(disk_cache.get, key)
+    if row is None:
+        return None
+    body, codec, stored_at, expires_at = row
+    # Translate wall-clock timestamps onto the monotonic clock used in memory
+    offset = time.monotonic() - time.time()
+    entry = CacheEntry(body, codec, stored_at + offset, expires_at + offset)
+    response_cache.insert(key, entry)
+    return entry
+
+def wall_clock(entry: CacheEntry) -> Tuple[float, float]:
+    """(stored_at, expires_at) of an in-memory entry on the wall clock"""
+    offset = time.time() - time.monotonic()
+    return entry.stored_at + offset, entry.expires_at + offset
+
+demotions: set = set()
+
+def demote(key: tuple, entry: CacheEntry):
+    """Memory eviction hook: move the entry down to the disk tier"""
+    if disk_cache is None or DISK_CACHE_WRITE_THROUGH or entry.error is not None:
+        return  # Write-through already put it there; failures stay in memory
+    stored_at, expires_at = wall_clock(entry)
+    task = asyncio.ensure_future(asyncio.to_thread(
+        disk_cache.set, key, entry.body, entry.codec, stored_at, expires_at))
+    demotions.add(task)
+    task.add_done_callback(demotions.discard)
+
+def demote_all():
+    """Flush the memory tier to disk so a restart finds it (victim-tier mode)"""
+    if disk_cache is None or DISK_CACHE_WRITE_THROUGH:
+        return
+    for key, entry in list(response_cache.entries.items()):
+        if entry.error is not None:
+            continue
+        try:
+            disk_cache.set(key, entry.body, entry.codec, *wall_clock(entry))
+        except sqlite3.Error:
+            break
+
+response_cache.on_evict = demote
+
+async def disk_compactor():
+    """Periodically compact the disk cache"""
+    while True:
+        await asyncio.sleep(DISK_CACHE_COMPACT_INTERVAL)
+        try:
+            await asyncio.to_thread(disk_cache.compact)
+        except sqlite3.Error:
+            pass
+
+# Request coalescing: concurrent identical queries share one upstream call
+inflight: Dict[tuple, asyncio.Future] = {}
+
+# Query normalization: equivalent spellings share one cache/coalescing key
+QUERY_NORMALIZATION = [rule.strip() for rule in
+                       os.getenv("QUERY_NORMALIZATION", "nfkc,casefold,whitespace").split(",")
+                       if rule.strip()]
+# "original" sends the caller's query upstream, "normalized" the canonical form
+UPSTREAM_QUERY = os.getenv("UPSTREAM_QUERY", "original")
+
+WHITESPACE = re.compile(r"\s+")
+PUNCTUATION = re.compile(r"[^\w\s+#.-]")  # Keeps c++, c#, .net, node.js
+
+NORMALIZERS: Dict[str, Callable[[str], str]] = {
+    "nfkc": lambda q: unicodedata.normalize("NFKC", q),
+    "casefold": str.casefold,
+    "whitespace": lambda q: WHITESPACE.sub(" ", q).strip(),
+    "punctuation": lambda q: PUNCTUATION.sub(" ", q),
+}
+
+def normalize_query(query: str) -> str:
+    """Canonical form of a query, per the QUERY_NORMALIZATION rules in order"""
+    for rule in QUERY_NORMALIZATION:
+        normalizer = NORMALIZERS.get(rule)
+        if normalizer is not None:
+            query = normalizer(query)
+    return query
+
+def request_key(query: str, category: str, language: str, safesearch: int) -> tuple:
+    return (category, normalize_query(query), language.lower(), safesearch)
+
+def cache_failure(key: tuple, error: HTTPException):
+    """Remember an upstream failure, unless a retained result can serve it stale"""
+    existing = response_cache.entries.get(key)
+    if NEGATIVE_CACHE_TTL <= 0 or (existing is not None and existing.error is None):
+        return
+    now = time.monotonic()
+    response_cache.insert(key, CacheEntry(b"", "identity", now, now + NEGATIVE_CACHE_TTL,
+                                          error=error.detail))
+
+async def fetch_and_cache(key: tuple, query: str, category: str,
+                          language: str, safesearch: int) -> CacheEntry:
+    started = time.perf_counter()
+    try:
+        results = await search_with_fallback(query, category, language, safesearch)
+    except HTTPException as e:
+        if CACHE_ENABLED:
+            cache_failure(key, e)
+        raise
+    count = len(results.results)
+    ttl = cache_ttl(category) if count else min(cache_ttl(category), EMPTY_RESULT_TTL)
+    now = time.monotonic()
+    # The fetch's own callers get a copy carrying the decoded page, so each one
+    # encodes only the results its `limit` asks for; the cache keeps the full page
+    served = CacheEntry(b"", "identity", now, now + ttl, count=count)
+    served.page = results
+    if not CACHE_ENABLED:
+        return served
+    entry = CacheEntry(encode_body(results.to_dict(), CACHE_CODEC), CACHE_CODEC, now, now + ttl,
+                       count=count)
+    entry.delta = time.perf_counter() - started
+    served.body, served.codec = entry.body, entry.codec
+    response_cache.insert(key, entry)
+    if disk_cache is not None and DISK_CACHE_WRITE_THROUGH:
+        stored_at, expires_at = wall_clock(entry)
+        try:
+            await asyncio.to_thread(disk_cache.set, key, entry.body, entry.codec, stored_at, expires_at)
+        except sqlite3.Error:
+            pass  # The disk tier is best-effort
+    return served
+
+def start_fetch(key: tuple, query: str, category: str,
+                language: str, safesearch: int) -> asyncio.Future:
+    """Upstream fetch for `key`, joining the one already in flight if any"""
+    future = inflight.get(key)
+    if future is None:
+        future = asyncio.ensure_future(
+            fetch_and_cache(key, query, category, language, safesearch))
+        inflight[key] = future
+
+        def forget(done: asyncio.Future):
+            if inflight.get(key) is done:
+                del inflight[key]
+            if not done.cancelled():
+                done.exception()  # Background refreshes may have no awaiter
+        future.add_done_callback(forget)
+    return future
+
+async def cached_search(query: str, category: str = "general",
+                        language: str = "en", safesearch: int = 1,
+                        max_age: Optional[float] = None) -> Tuple[tuple, CacheEntry]:
+    """Cached search_with_fallback, joining an identical call already in flight"""
+    key = request_key(query, category, language, safesearch)
+    if UPSTREAM_QUERY == "normalized":
+        query = key[1]
+    entry = response_cache.lookup(key) if CACHE_ENABLED else None
+    if entry is None and CACHE_ENABLED and disk_cache is not None:
+        try:
+            entry = await load_from_disk(key)
+        except sqlite3.Error:
+            entry = None
+    if entry is not None and entry.error is not None:
+        if entry.is_fresh(time.monotonic(), max_age):
+            response_cache.negative_hits += 1
+            raise HTTPException(status_code=503, detail=entry.error)
+        entry = None  # Failures are never served stale
+    if entry is not None:
+        now = time.monotonic()
+        if entry.is_fresh(now, max_age):
+            response_cache.hits += 1
+            if entry.refresh_early(now) and key not in inflight:
+                response_cache.early_refreshes += 1
+                start_fetch(key, query, category, language, safesearch)
+            return key, entry
+        if max_age is None and now < entry.expires_at + CACHE_STALE_WHILE_REVALIDATE:
+            response_cache.stale_hits += 1
+            start_fetch(key, query, category, language, safesearch)
+            return key, entry
+    if CACHE_ENABLED:
+        response_cache.misses += 1
+    future = start_fetch(key, query, category, language, safesearch)
+    try:
+        # Shield so one disconnecting caller doesn't cancel the call for the others
+        return key, await asyncio.shield(future)
+    except HTTPException:
+        if (entry is not None and max_age is None
+                and time.monotonic() < entry.expires_at + CACHE_STALE_IF_ERROR):
+            response_cache.stale_if_error += 1
+            return key, entry
+        raise
+
+def limit_results(results: dict, limit: int) -> dict:
+    """Copy of a (possibly shared) result with at most `limit` results"""
+    results = dict(results)
+    if "results" in results:
+        results["results"] = results["results"][:limit]
+    return results
+
+# Field projection: `fields=title,url` keeps only the named keys. Names are matched
+# against both result keys and top-level keys; `results` itself is always sent,
+# and results are only trimmed when at least one result key is named
+RESULT_FIELDS = frozenset(SearchResult.__slots__)
+TOP_LEVEL_FIELDS = frozenset(SearchResponse.__slots__[:-1]) - {"results"} | {"_instance_used"}
+
+def parse_fields(fields: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """Canonical (sorted, deduplicated) field names, or None to send everything"""
+    if fields is None:
+        return None
+    names = {name.strip() for name in fields.split(",") if name.strip()}
+    if not names:
+        return None
+    unknown = names - RESULT_FIELDS - TOP_LEVEL_FIELDS
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return tuple(sorted(names))
+
+def project_fields(results: dict, fields: Tuple[str, ...]) -> dict:
+    """Copy of a result with only the named top-level and result keys"""
+    projected = {name: results[name] for name in fields if name in TOP_LEVEL_FIELDS and name in results}
+    keep = [name for name in fields if name in RESULT_FIELDS]
+    items = results.get("results", [])
+    if keep:
+        items = [{name: item[name] for name in keep if name in item} for item in items]
+    projected["results"] = items
+    return projected
+
+def render(key: tuple, entry: CacheEntry, limit: int, accept_encoding: str,
+           fields: Optional[Tuple[str, ...]] = None) -> Response:
+    """Send a cached entry as stored bytes, re-encoding only when `limit` or `fields` trims it"""
+    body = entry.body
+    if entry.page is not None and (fields is not None or not body or limit < entry.count):
+        # Fresh from upstream: encode straight from the decoded page, not the stored body
+        value = entry.page.to_dict(limit)
+        if fields is not None:
+            value = project_fields(value, fields)
+        body = encode_body(value, entry.codec)
+    elif fields is not None or entry.count is None or limit < entry.count:
+        variant = entry.variants.get((limit, fields)) if entry.variants else None
+        if variant is not None:
+            body = variant
+        else:
+            value = entry.value
+            entry.count = len(value.get("results", []))
+            if fields is not None or limit < entry.count:
+                value = limit_results(value, limit)
+                if fields is not None:
+                    value = project_fields(value, fields)
+                body = encode_body(value, entry.codec)
+                response_cache.add_variant(key, entry, (limit, fields), body)
+    headers = {"Vary": "Accept-Encoding"}
+    if entry.codec != "identity":
+        if negotiate_encoding(accept_encoding, [entry.codec]) is not None:
+            headers["Content-Encoding"] = entry.codec
+        else:
+            body = decompress(body, entry.codec)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+async def respond(request: Request, query: str, category: str, language: str,
+                  safesearch: int, max_age: Optional[float], limit: int,
+                  fields: Optional[str] = None) -> Response:
+    projection = parse_fields(fields)
+    key, entry = await cached_search(query, category, language, safesearch, max_age)
+    if query_log is not None:
+        query_log.record(key)
+    heavy_hitters.add(key)
+    return render(key, entry, limit, request.headers.get("accept-encoding", ""), projection)
+
+# Query log: normalized keys served by the search endpoints, replayed at startup
+# to warm the cache. Lines are "count<TAB>category<TAB>language<TAB>safesearch<TAB>query".
+QUERY_LOG_PATH = os.getenv("QUERY_LOG_PATH", "")
+QUERY_LOG_FLUSH_INTERVAL = float(os.getenv("QUERY_LOG_FLUSH_INTERVAL", "5"))
+QUERY_LOG_MAX_BYTES = int(os.getenv("QUERY_LOG_MAX_BYTES", str(8 * 1024 * 1024)))
+QUERY_LOG_MAX_KEYS = int(os.getenv("QUERY_LOG_MAX_KEYS", "10000"))
+WARMUP_TOP_N = int(os.getenv("WARMUP_TOP_N", "100"))
+WARMUP_RATE = float(os.getenv("WARMUP_RATE", "2"))  # Upstream queries per second
+
+class QueryLog:
+    """Append-only log of query counts, aggregated in memory between flushes"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.pending: Counter = Counter()
+
+    def record(self, key: tuple):
+        self.pending[key] += 1
+
+    def flush(self):
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, Counter()
+        # One write per flush; O_APPEND keeps lines from several workers intact
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(self.format(key, count) for key, count in pending.items()))
+        if os.path.getsize(self.path) > QUERY_LOG_MAX_BYTES:
+            self.compact(self.read())
+
+    @staticmethod
+    def format(key: tuple, count: int) -> str:
+        category, query, language, safesearch = key
+        query = query.replace("\t", " ").replace("\n", " ")
+        return f"{count}\t{category}\t{language}\t{safesearch}\t{query}\n"
+
+    def read(self) -> Counter:
+        """Aggregate counts per key"""
+        counts: Counter = Counter()
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    fields = line.rstrip("\n").split("\t")
+                    if len(fields) != 5 or not fields[0].isdigit() or not fields[3].isdigit():
+                        continue  # Torn or foreign line
+                    count, category, language, safesearch, query = fields
+                    counts[(category, query, language, int(safesearch))] += int(count)
+        except FileNotFoundError:
+            pass
+        return counts
+
+    def compact(self, counts: Counter):
+        """Rewrite the log as one line per top key; lines other workers append meanwhile are lost"""
+        compacted = f"{self.path}.{os.getpid()}.tmp"
+        with open(compacted, "w", encoding="utf-8") as f:
+            f.write("".join(self.format(key, count)
+                            for key, count in counts.most_common(QUERY_LOG_MAX_KEYS)))
+        os.replace(compacted, self.path)
+
+    def load(self) -> Counter:
+        """Aggregate counts; rewrite the log compacted once it outgrows its budget"""
+        counts = self.read()
+        if os.path.exists(self.path) and os.path.getsize(self.path) > QUERY_LOG_MAX_BYTES:
+            self.compact(counts)
+        return counts
+
+query_log: Optional[QueryLog] = None
+
+async def query_log_flusher():
+    while True:
+        await asyncio.sleep(QUERY_LOG_FLUSH_INTERVAL)
+        try:
+            await asyncio.to_thread(query_log.flush)
+        except OSError:
+            pass
+
+async def warm_up():
+    """Replay the most frequent logged queries at a bounded rate"""
+    try:
+        counts = await asyncio.to_thread(query_log.load)
+    except OSError:
+        return
+    for (category, query, language, safesearch), _ in counts.most_common(WARMUP_TOP_N):
+        key = (category, query, language, safesearch)
+        if key in response_cache.entries:
+            continue  # Already warm (e.g. promoted from disk by another worker's traffic)
+        try:
+            await cached_search(query, category, language, safesearch)
+        except HTTPException:
+            pass
+        await asyncio.sleep(1 / WARMUP_RATE)
+
+# Heavy hitters: a count-min sketch estimates every key's frequency in fixed
+# memory; the top-K keys are pinned in cache and refreshed before they expire
+HEAVY_HITTERS_K = int(os.getenv("HEAVY_HITTERS_K", "50"))
+SKETCH_WIDTH = int(os.getenv("SKETCH_WIDTH", "4096"))
+SKETCH_DEPTH = int(os.getenv("SKETCH_DEPTH", "4"))
+SKETCH_DECAY_INTERVAL = float(os.getenv("SKETCH_DECAY_INTERVAL", "600"))
+HOT_REFRESH_INTERVAL = float(os.getenv("HOT_REFRESH_INTERVAL", "30"))
+
+class CountMinSketch:
+    """Frequency estimates with bounded overcount, in width * depth counters"""
+
+    def __init__(self, width: int = SKETCH_WIDTH, depth: int = SKETCH_DEPTH):
+        self.width = width
+        self.rows = [[0] * width for _ in range(depth)]
+
+    def add(self, item, count: int = 1) -> int:
+        """Count `item` and return its new estimate"""
+        estimate = None
+        for seed, row in enumerate(self.rows):
+            column = hash((seed, item)) % self.width
+            row[column] += count
+            if estimate is None or row[column] < estimate:
+                estimate = row[column]
+        return estimate
+
+    def estimate(self, item) -> int:
+        return min(row[hash((seed, item)) % self.width] for seed, row in enumerate(self.rows))
+
+    def decay(self):
+        """Halve every counter so the sketch tracks recent popularity"""
+        for row in self.rows:
+            for i, value in enumerate(row):
+                row[i] = value >> 1
+
+class HeavyHitters:
+    """Top-K keys by sketch estimate, kept in a min-heap"""
+
+    def __init__(self, k: int = HEAVY_HITTERS_K):
+        self.k = k
+        self.sketch = CountMinSketch()
+        self.heap: List[Tuple[int, tuple]] = []  # (estimate, key); may hold stale estimates
+        self.top: Dict[tuple, int] = {}
+
+    def add(self, key: tuple):
+        if self.k <= 0:
+            return
+        estimate = self.sketch.add(key)
+        if key in self.top:
+            self.top[key] = estimate
+            return
+        if len(self.top) < self.k:
+            self.top[key] = estimate
+            heapq.heappush(self.heap, (estimate, key))
+            return
+        # Pop stale heap entries until the root reflects its key's current estimate
+        while self.heap and self.heap[0][0] != self.top.get(self.heap[0][1]):
+            smallest_key = heapq.heappop(self.heap)[1]
+            if smallest_key in self.top:
+                heapq.heappush(self.heap, (self.top[smallest_key], smallest_key))
+        if self.heap and estimate > self.heap[0][0]:
+            _, evicted = heapq.heapreplace(self.heap, (estimate, key))
+            del self.top[evicted]
+            self.top[key] = estimate
+
+    def most_common(self) -> List[Tuple[tuple, int]]:
+        return sorted(self.top.items(), key=lambda item: item[1], reverse=True)
+
+    def decay(self):
+        self.sketch.decay()
+        self.top = {key: count >> 1 for key, count in self.top.items()}
+        self.heap = [(count, key) for key, count in self.top.items()]
+        heapq.heapify(self.heap)
+
+heavy_hitters = HeavyHitters()
+
+async def hot_key_refresher():
+    """Pin the current top keys and refresh them before they go stale"""
+    last_decay = time.monotonic()
+    while True:
+        await asyncio.sleep(HOT_REFRESH_INTERVAL)
+        if time.monotonic() - last_decay >= SKETCH_DECAY_INTERVAL:
+            heavy_hitters.decay()
+            last_decay = time.monotonic()
+        hot = [key for key, _ in heavy_hitters.most_common()]
+        response_cache.pinned = set(hot)
+        # Anything expiring before the next pass is refreshed now
+        horizon = time.monotonic() + HOT_REFRESH_INTERVAL
+        for key in hot:
+            entry = response_cache.entries.get(key)
+            if entry is not None and (entry.error is not None or entry.expires_at > horizon):
+                continue
+            category, query, language, safesearch = key
+            start_fetch(key, query, category, language, safesearch)
+
+# Cache snapshots: the memory tier as one compact binary file, restored at boot.
+# Layout: MAGIC, uint32 entry count, then per entry a fixed header
+# (key length, body length, stored_at, expires_at, result count or -1, codec
+# length) followed by the JSON key, the codec name and the stored body.
+CACHE_SNAPSHOT_PATH = os.getenv("CACHE_SNAPSHOT_PATH", "")
+SNAPSHOT_MAGIC = b"SXSNAP1\0"
+SNAPSHOT_COUNT = struct.Struct("<I")
+SNAPSHOT_ENTRY = struct.Struct("<IIddiB")
+
+def dump_snapshot() -> bytes:
+    """Serialize the memory tier's positive entries (wall-clock timestamps)"""
+    records = []
+    total = 0
+    for key, entry in list(response_cache.entries.items()):
+        if entry.error is not None:
+            continue
+        total += 1
+        key_bytes = json.dumps(key).encode()
+        codec = entry.codec.encode()
+        stored_at, expires_at = wall_clock(entry)
+        count = entry.count if entry.count is not None else -1
+        records.append(SNAPSHOT_ENTRY.pack(len(key_bytes), len(entry.body), stored_at,
+                                           expires_at, count, len(codec)))
+        records += (key_bytes, codec, entry.body)
+    return b"".join([SNAPSHOT_MAGIC, SNAPSHOT_COUNT.pack(total)] + records)
+
+def parse_snapshot(data) -> List[Tuple[tuple, CacheEntry]]:
+    """Decode and validate every entry of snapshot bytes (or an mmap); ValueError if malformed"""
+    view = memoryview(data)
+    if bytes(view[:len(SNAPSHOT_MAGIC)]) != SNAPSHOT_MAGIC:
+        raise ValueError("Not a cache snapshot")
+    offset = len(SNAPSHOT_MAGIC)
+
+    def take(size: int) -> memoryview:
+        nonlocal offset
+        if offset + size > len(view):
+            raise ValueError(f"Snapshot truncated at byte {offset}")
+        chunk = view[offset:offset + size]
+        offset += size
+        return chunk
+
+    (total,) = SNAPSHOT_COUNT.unpack(take(SNAPSHOT_COUNT.size))
+    clock = time.monotonic() - time.time()
+    entries = []
+    for _ in range(total):
+        key_len, body_len, stored_at, expires_at, count, codec_len = \
+            SNAPSHOT_ENTRY.unpack(take(SNAPSHOT_ENTRY.size))
+        key = json.loads(bytes(take(key_len)))
+        if not (isinstance(key, list) and len(key) == 4
+                and all(isinstance(part, str) for part in key[:3])
+                and type(key[3]) is int):
+            raise ValueError(f"Snapshot key at byte {offset - key_len} is not"
+                             " [category, query, language, safesearch]")
+        codec = bytes(take(codec_len)).decode()
+        body = bytes(take(body_len))
+        entries.append((tuple(key), CacheEntry(body, codec, stored_at + clock, expires_at + clock,
+                                               count=count if count >= 0 else None)))
+    if offset != len(view):
+        raise ValueError(f"{len(view) - offset} trailing bytes after the last snapshot entry")
+    return entries
+
+def load_snapshot(data) -> int:
+    """Insert entries from snapshot bytes (or an mmap) into the memory tier, all or nothing"""
+    entries = parse_snapshot(data)
+    now = time.monotonic()
+    loaded = 0
+    for key, entry in entries:
+        if entry.expires_at + response_cache.grace <= now or entry.codec not in available_codecs():
+            continue
+        response_cache.insert(key, entry)
+        loaded += 1
+    return loaded
+
+def load_snapshot_file(path: str) -> int:
+    """Memory-map a snapshot file and load it"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return load_snapshot(mapped)
+
+def save_snapshot_file(path: str) -> int:
+    """Write a snapshot atomically; returns its size in bytes"""
+    data = dump_snapshot()
+    tmp = f"{path}.{os.getpid()}.tmp"  # Workers may all save at shutdown
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return len(data)
+
+# Admin endpoints are disabled unless ADMIN_TOKEN is set
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+def require_admin(request: Request):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    token = request.headers.get("x-admin-token", "")
+    if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+# Background health prober: /health and instance selection read its scoreboard
+HEALTH_INTERVAL = float(os.getenv("HEALTH_INTERVAL", "30"))
+HEALTH_TIMEOUT = float(os.getenv("HEALTH_TIMEOUT", "10"))
+
+class HealthRecord:
+    """Latest probe outcome for one instance"""
+
+    __slots__ = ("up", "latency", "last_error", "checked_at")
+
+    def __init__(self):
+        self.up: Optional[bool] = None  # None until the first probe completes
+        self.latency: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.checked_at: Optional[float] = None
+
+    def as_dict(self) -> dict:
+        return {
+            "up": self.up,
+            "latency": self.latency,
+            "last_error": self.last_error,
+            "checked_at": self.checked_at,
+        }
+
+scoreboard: Dict[str, HealthRecord] = {}
+health_report: dict = {
+    "status": "degraded",
+    "message": "No probe results yet",
+    "available_instances": len(SEARXNG_INSTANCES),
+}
+
+def is_down(instance: str) -> bool:
+    record = scoreboard.get(instance)
+    return record is not None and record.up is False
+
+async def probe_instance(instance: str):
+    """Probe one instance and record the outcome in the scoreboard"""
+    record = scoreboard.setdefault(instance, HealthRecord())
+    started = time.perf_counter()
+    try:
+        response = await get_client(instance).get("/healthz", timeout=HEALTH_TIMEOUT)
+        if response.status_code in [200, 404]:  # 404 is OK, means SearXNG is there
+            record.up = True
+            record.last_error = None
+        else:
+            record.up = False
+            record.last_error = f"HTTP {response.status_code}"
+    except Exception as e:
+        record.up = False
+        record.last_error = f"{type(e).__name__}: {e}"
+    record.latency = time.perf_counter() - started
+    record.checked_at = time.time()
+
+def build_health_report() -> dict:
+    """Precompute the /health body so the endpoint is a constant-time read"""
+    up = [i for i in SEARXNG_INSTANCES if scoreboard.get(i) and scoreboard[i].up]
+    report = {
+        "available_instances": len(SEARXNG_INSTANCES),
+        "healthy_instances": len(up),
+        "instances": {
+            instance: dict(scoreboard[instance].as_dict(), circuit=get_breaker(instance).state)
+            for instance in SEARXNG_INSTANCES if instance in scoreboard
+        },
+    }
+    if up:
+        fastest = min(up, key=lambda instance: scoreboard[instance].latency)
+        report.update(status="healthy", instance=fastest)
+    else:
+        report.update(status="degraded", message="Some instances may be unavailable")
+    return report
+
+async def health_prober():
+    """Probe every instance on an interval, forever"""
+    global health_report
+    while True:
+        await asyncio.gather(*(probe_instance(i) for i in SEARXNG_INSTANCES))
+        health_report = build_health_report()
+        await asyncio.sleep(HEALTH_INTERVAL)
+
 @app.get("/")
 async def root():
     return {
         "message": "SearXNG Search API",
         "docs": "/docs",
-        "endpoints": ["/search", "/news", "/images", "/videos", "/health"]
+        "endpoints": ["/search", "/news", "/images", "/videos", "/health", "/stats"]
     }
 
 @app.get("/health")
 async def health():
-    """Check if at least one instance is working"""
-    for instance in SEARXNG_INSTANCES[:3]:
-        try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.get(f"{instance}/healthz")
-                if response.status_code in [200, 404]:  # 404 is OK, means SearXNG is there
-                    return {
-                        "status": "healthy",
-                        "instance": instance,
-                        "available_instances": len(SEARXNG_INSTANCES)
-                    }
-        except:
-            continue
-    
+    """Report instance health from the background prober's latest round"""
+    return health_report
+
+@app.get("/stats")
+async def stats():
+    """Cache and coalescing counters for this worker"""
+    cache = response_cache.stats()
+    disk = disk_cache.stats() if disk_cache is not None else None
+    return {
+        "cache": cache,
+        "disk_cache": disk,
+        "tiers": {
+            "memory_hit_ratio": cache["memory_hit_ratio"],
+            "disk_hit_ratio": disk["hit_ratio"] if disk is not None else None,
+        },
+        "inflight": len(inflight),
+        "compression": compression_stats.stats(),
+    }
+
+MAX_AGE_DESCRIPTION = "Oldest acceptable cached result in seconds (0 bypasses the cache)"
+FIELDS_DESCRIPTION = "Comma-separated result and top-level keys to return, e.g. title,url"
+
+@app.get("/admin/cache/snapshot", dependencies=[Depends(require_admin)])
+async def export_snapshot():
+    """Download the memory cache as a snapshot file"""
+    return Response(content=dump_snapshot(), media_type="application/octet-stream")
+
+@app.post("/admin/cache/snapshot", dependencies=[Depends(require_admin)])
+async def import_snapshot(request: Request):
+    """Load a snapshot file (request body) into the memory cache"""
+    try:
+        loaded = load_snapshot(await request.body())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid snapshot: {e}")
+    return {"loaded": loaded, "entries": len(response_cache.entries)}
+
+@app.get("/admin/top-queries", dependencies=[Depends(require_admin)])
+async def top_queries():
+    """Current heavy-hitter queries (estimated counts) and pinned cache keys"""
     return {
-        "status": "degraded",
-        "message": "Some instances may be unavailable",
-        "available_instances": len(SEARXNG_INSTANCES)
+        "queries": [
+            {"category": category, "query": query, "language": language,
+             "safesearch": safesearch, "count": count,
+             "cached": (category, query, language, safesearch) in response_cache.entries}
+            for (category, query, language, safesearch), count in heavy_hitters.most_common()
+        ],
+        "pinned": len(response_cache.pinned),
     }
 
 @app.get("/search")
 async def search(
+    request: Request,
     q: str = Query(..., description="Search query"),
     limit: int = Query(10, ge=1, le=100, description="Number of results"),
     language: str = Query("en", description="Language code"),
-    safesearch: int = Query(1, ge=0, le=2, description="Safe search level")
+    safesearch: int = Query(1, ge=0, le=2, description="Safe search level"),
+    max_age: Optional[int] = Query(None, ge=0, description=MAX_AGE_DESCRIPTION),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
 ):
     """General web search"""
-    results = await search_with_fallback(q, "general", language, safesearch)
-    
-    # Limit results
-    if "results" in results:
-        results["results"] = results["results"][:limit]
-    
-    return results
+    return await respond(request, q, "general", language, safesearch, max_age, limit, fields)
 
 @app.get("/news")
 async def news(
+    request: Request,
     q: str = Query(..., description="News search query"),
     limit: int = Query(10, ge=1, le=100),
     language: str = Query("en"),
-    safesearch: int = Query(1, ge=0, le=2)
+    safesearch: int = Query(1, ge=0, le=2),
+    max_age: Optional[int] = Query(None, ge=0, description=MAX_AGE_DESCRIPTION),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
 ):
     """News search"""
-    results = await search_with_fallback(q, "news", language, safesearch)
-    
-    if "results" in results:
-        results["results"] = results["results"][:limit]
-    
-    return results
+    return await respond(request, q, "news", language, safesearch, max_age, limit, fields)
 
 @app.get("/images")
 async def images(
+    request: Request,
     q: str = Query(..., description="Image search query"),
     limit: int = Query(20, ge=1, le=100),
     language: str = Query("en"),
-    safesearch: int = Query(1, ge=0, le=2)
+    safesearch: int = Query(1, ge=0, le=2),
+    max_age: Optional[int] = Query(None, ge=0, description=MAX_AGE_DESCRIPTION),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
 ):
     """Image search"""
-    results = await search_with_fallback(q, "images", language, safesearch)
-    
-    if "results" in results:
-        results["results"] = results["results"][:limit]
-    
-    return results
+    return await respond(request, q, "images", language, safesearch, max_age, limit, fields)
 
 @app.get("/videos")
 async def videos(
+    request: Request,
     q: str = Query(..., description="Video search query"),
     limit: int = Query(10, ge=1, le=100),
     language: str = Query("en"),
-    safesearch: int = Query(1, ge=0, le=2)
+    safesearch: int = Query(1, ge=0, le=2),
+    max_age: Optional[int] = Query(None, ge=0, description=MAX_AGE_DESCRIPTION),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
 ):
     """Video search"""
-    results = await search_with_fallback(q, "videos", language, safesearch)
-    
-    if "results" in results:
-        results["results"] = results["results"][:limit]
-    
-    return results
+    return await respond(request, q, "videos", language, safesearch, max_age, limit, fields)
+
+def cli(argv: Optional[List[str]] = None):
+    """Serve the API (default) or move cache snapshots to/from a running server"""
+    parser = argparse.ArgumentParser(description="SearXNG Search API")
+    commands = parser.add_subparsers(dest="command")
+    serve = commands.add_parser("serve", help="Run the API server")
+    serve.add_argument("--host", default="0.0.0.0")
+    serve.add_argument("--port", type=int, default=8080)
+    for name, summary in [("export", "Download a running server's cache snapshot"),
+                          ("import", "Upload a snapshot into a running server's cache")]:
+        command = commands.add_parser(f"snapshot-{name}", help=summary)
+        command.add_argument("file")
+        command.add_argument("--url", default="http://localhost:8080")
+        command.add_argument("--token", default=ADMIN_TOKEN)
+    info = commands.add_parser("snapshot-info", help="Summarize a snapshot file")
+    info.add_argument("file")
+    args = parser.parse_args(argv)
+
+    if args.command in (None, "serve"):
+        import uvicorn
+        uvicorn.run(app, host=getattr(args, "host", "0.0.0.0"), port=getattr(args, "port", 8080))
+    elif args.command == "snapshot-export":
+        response = httpx.get(f"{args.url}/admin/cache/snapshot",
+                             headers={"X-Admin-Token": args.token}, timeout=60)
+        response.raise_for_status()
+        with open(args.file, "wb") as f:
+            f.write(response.content)
+        print(f"Wrote {len(response.content)} bytes to {args.file}")
+    elif args.command == "snapshot-import":
+        with open(args.file, "rb") as f:
+            response = httpx.post(f"{args.url}/admin/cache/snapshot", content=f.read(),
+                                  headers={"X-Admin-Token": args.token}, timeout=60)
+        response.raise_for_status()
+        print(response.json())
+    elif args.command == "snapshot-info":
+        started = time.perf_counter()
+        loaded = load_snapshot_file(args.file)
+        print(f"{loaded} live entries, {response_cache.bytes} bytes, "
+              f"loaded in {(time.perf_counter() - started) * 1000:.1f} ms")
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8080)
+    cli()